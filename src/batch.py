@@ -0,0 +1,224 @@
+"""
+Converts many svgs at once, answering with a zip of dxfs and a manifest.json listing the outcome per file.
+
+Per file layer styles are given as json mapping file names to layer styles,
+{"sheet-1.svg": {"cut": {"color": "#ff0000"}}}, and override the shared layer styles layer by layer.
+"""
+from __future__ import print_function
+import json
+import posixpath
+import StringIO
+import struct
+import tarfile
+import unittest
+import zipfile
+
+LAYER_STYLES_NAME = 'layer_styles.json'
+MANIFEST_NAME = 'manifest.json'
+
+
+class UnsupportedArchive(Exception):
+    pass
+
+
+class ArchiveTooLarge(Exception):
+    pass
+
+
+def parse_per_file_styles(s):
+    """
+    Parses per file layer styles from json, raises ValueError unless they map file names to layer styles.
+    """
+    per_file_styles = json.loads(s)
+    if not isinstance(per_file_styles, dict) or not all(
+            isinstance(layer_to_style, dict) and all(isinstance(style, dict) for style in layer_to_style.values())
+            for layer_to_style in per_file_styles.values()):
+        raise ValueError("layer styles must map file names to {layer: style} objects")
+    return per_file_styles
+
+
+def _read_member(f, name, remaining):
+    # read no more than the declared sizes allow, whatever the member actually decompresses to
+    content = f.read(remaining + 1)
+    if len(content) > remaining:
+        raise ArchiveTooLarge("archive member %s holds more than declared" % name)
+    return content
+
+
+def read_archive(archive_file, max_size=None):
+    """
+    Reads a zip or tar (optionally compressed) archive from a seekable file.
+    Returns the [(name, svg)] found in it, in archive order, and the per file layer styles.
+    Raises ArchiveTooLarge if its files hold more than max_size bytes together, before reading them.
+    """
+    members = []
+    if zipfile.is_zipfile(archive_file):
+        archive_file.seek(0)
+        with zipfile.ZipFile(archive_file) as archive:
+            infos = [info for info in archive.infolist() if not info.filename.endswith('/')]
+            remaining = _check_size(sum(info.file_size for info in infos), max_size)
+            for info in infos:
+                content = _read_member(archive.open(info), info.filename, remaining)
+                remaining -= len(content)
+                members.append((info.filename, content))
+    else:
+        archive_file.seek(0)
+        try:
+            archive = tarfile.open(fileobj=archive_file)
+        except tarfile.TarError:
+            raise UnsupportedArchive("expected a zip or tar archive")
+        with archive:
+            infos = [info for info in archive if info.isfile()]
+            _check_size(sum(info.size for info in infos), max_size)
+            for info in infos:
+                members.append((info.name, archive.extractfile(info).read()))
+
+    files = []
+    per_file_styles = {}
+    for name, content in members:
+        if name == LAYER_STYLES_NAME:
+            per_file_styles = parse_per_file_styles(content)
+        elif name.lower().endswith('.svg'):
+            files.append((name, content))
+    return files, per_file_styles
+
+
+def _check_size(size, max_size):
+    if max_size is not None and size > max_size:
+        raise ArchiveTooLarge("archive members hold %d bytes, more than %d" % (size, max_size))
+    return size
+
+
+def dxf_name(name):
+    return posixpath.splitext(name)[0] + '.dxf'
+
+
+def _convert_file(task):
+    import svg_to_dxf
+
+    name, svg, layer_to_style, options = task
+    dxf_out = StringIO.StringIO()
+    try:
+        svg_to_dxf.convert(svg_in=StringIO.StringIO(svg), dxf_out=dxf_out, layer_to_style=layer_to_style,
+                           **options)
+    except Exception as e:
+        return name, None, str(e)
+    return name, dxf_out.getvalue(), None
+
+
+class _ChunkWriter(object):
+    """
+    Write only file handing out what was written since the last drain, so a zip can be streamed.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(data)
+        self._position += len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = ''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def convert_all(pool, files, layer_to_style=None, per_file_styles=None, options=None):
+    """
+    Converts files, [(name, svg)], in pool and yields the resulting zip in chunks as conversions finish.
+    options are ConvertOptions keyword arguments.
+    """
+    tasks = []
+    for name, svg in files:
+        file_layer_to_style = dict(layer_to_style or {})
+        file_layer_to_style.update((per_file_styles or {}).get(name, {}))
+        tasks.append((name, svg, file_layer_to_style, options or {}))
+
+    out = _ChunkWriter()
+    manifest = []
+    archive = zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED)
+    for name, dxf, error in pool.imap(_convert_file, tasks):
+        if error is None:
+            archive.writestr(dxf_name(name), dxf)
+            manifest.append({'name': name, 'status': 'ok', 'dxf': dxf_name(name)})
+        else:
+            manifest.append({'name': name, 'status': 'failed', 'error': error})
+        yield out.drain()
+
+    archive.writestr(MANIFEST_NAME, json.dumps(manifest, indent=2))
+    archive.close()
+    yield out.drain()
+
+
+class _SerialPool(object):
+    # noinspection PyMethodMayBeStatic
+    def imap(self, func, iterable):
+        return (func(e) for e in iterable)
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        import svg_to_dxf
+
+        self.svg = svg_to_dxf._TEST_SVG
+
+    def testReadZip(self):
+        data = StringIO.StringIO()
+        with zipfile.ZipFile(data, 'w') as archive:
+            archive.writestr('sheets/a.svg', self.svg)
+            archive.writestr('notes.txt', 'ignored')
+            archive.writestr(LAYER_STYLES_NAME, json.dumps({'sheets/a.svg': {'cut': {'color': '#ff0000'}}}))
+        files, per_file_styles = read_archive(data)
+        self.assertEquals([('sheets/a.svg', self.svg)], files)
+        self.assertEquals({'sheets/a.svg': {'cut': {'color': '#ff0000'}}}, per_file_styles)
+
+    def testReadTar(self):
+        data = StringIO.StringIO()
+        with tarfile.open(fileobj=data, mode='w:gz') as archive:
+            info = tarfile.TarInfo('a.svg')
+            info.size = len(self.svg)
+            archive.addfile(info, StringIO.StringIO(self.svg))
+        self.assertEquals([('a.svg', self.svg)], read_archive(data)[0])
+
+    def testUnsupported(self):
+        self.assertRaises(UnsupportedArchive, read_archive, StringIO.StringIO('not an archive'))
+
+    def testInvalidLayerStyles(self):
+        self.assertEquals({}, parse_per_file_styles('{}'))
+        for s in ('[]', '{"a.svg": "cut"}', '{"a.svg": {"cut": 1}}', '{'):
+            self.assertRaises(ValueError, parse_per_file_styles, s)
+
+    def testTooLarge(self):
+        data = StringIO.StringIO()
+        with zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('a.svg', self.svg)
+            archive.writestr('b.svg', ' ' * 1000000)
+        self.assertRaises(ArchiveTooLarge, read_archive, data, 1000000)
+        self.assertEquals(2, len(read_archive(data, 1000000 + len(self.svg))[0]))
+
+        # a member declaring less than it holds
+        lying = StringIO.StringIO(data.getvalue().replace(struct.pack('<I', 1000000), struct.pack('<I', 10)))
+        self.assertRaises(ArchiveTooLarge, read_archive, lying)
+
+    def testConvertAll(self):
+        import svg_to_dxf
+
+        files = [('a.svg', self.svg), ('b.svg', '<svg')]
+        data = ''.join(convert_all(_SerialPool(), files, svg_to_dxf._TEST_LAYER_TO_STYLE))
+        with zipfile.ZipFile(StringIO.StringIO(data)) as archive:
+            self.assertEquals(['a.dxf', MANIFEST_NAME], archive.namelist())
+            manifest = json.loads(archive.read(MANIFEST_NAME))
+            self.assertEquals(svg_to_dxf._test_entities(), svg_to_dxf._entities_section(archive.read('a.dxf')))
+        self.assertEquals(['ok', 'failed'], [m['status'] for m in manifest])
+
+
+if __name__ == "__main__":
+    unittest.main()
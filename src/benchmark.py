@@ -0,0 +1,58 @@
+"""
+Times conversions of svgs with a growing number of processes:
+
+    python src/benchmark.py [--processes 1,2,4,8,16] [--repeat 3] examples/*.svg
+
+For each, prints the best wall time and the cpu time the converting process itself spent, which
+bounds the speedup more processes can give.
+"""
+from __future__ import print_function, division
+import argparse
+import os
+import resource
+import StringIO
+import time
+
+import svg_to_dxf
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(svg, processes, repeat):
+    """
+    Returns the best (wall time, own cpu time) of repeat conversions of svg.
+    """
+    best = None
+    for _ in range(repeat):
+        wall, cpu = time.time(), _cpu_time()
+        svg_to_dxf.convert(StringIO.StringIO(svg), StringIO.StringIO(), processes=processes)
+        result = time.time() - wall, _cpu_time() - cpu
+        if best is None or result < best:
+            best = result
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times svg to dxf conversions with a growing number of processes.")
+    parser.add_argument('--processes', default='1,2,4,8,16')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('svgs', nargs='+')
+    args = parser.parse_args()
+    processes = [int(p) for p in args.processes.split(',')]
+
+    print("%-32s %9s %9s %9s %8s" % ("file", "processes", "wall (s)", "own cpu", "speedup"))
+    for path in args.svgs:
+        with open(path) as f:
+            svg = f.read()
+        serial = None
+        for p in processes:
+            wall, cpu = measure(svg, p, args.repeat)
+            serial = serial or wall
+            print("%-32s %9d %9.3f %9.3f %7.2fx" % (os.path.basename(path), p, wall, cpu, serial / wall))
+
+
+if __name__ == "__main__":
+    main()
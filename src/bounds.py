@@ -0,0 +1,129 @@
+from __future__ import division, print_function
+import unittest
+
+
+class BoundingBox(object):
+    def __init__(self, min_x, min_y, max_x, max_y):
+        self.min_x = min_x
+        self.min_y = min_y
+        self.max_x = max_x
+        self.max_y = max_y
+
+    def union(self, o):
+        if o is None:
+            return self
+        return BoundingBox(min(self.min_x, o.min_x), min(self.min_y, o.min_y),
+                           max(self.max_x, o.max_x), max(self.max_y, o.max_y))
+
+    def intersects(self, o):
+        return (self.min_x <= o.max_x and o.min_x <= self.max_x and
+                self.min_y <= o.max_y and o.min_y <= self.max_y)
+
+    def contains(self, o):
+        return (self.min_x <= o.min_x and o.max_x <= self.max_x and
+                self.min_y <= o.min_y and o.max_y <= self.max_y)
+
+    def contains_point(self, p):
+        return self.min_x <= p[0] <= self.max_x and self.min_y <= p[1] <= self.max_y
+
+    def corners(self):
+        return [(self.min_x, self.min_y), (self.max_x, self.min_y),
+                (self.max_x, self.max_y), (self.min_x, self.max_y)]
+
+    def transformed(self, transform_):
+        return of_points([transform_.mult_point(p) for p in self.corners()])
+
+    def as_tuple(self):
+        return self.min_x, self.min_y, self.max_x, self.max_y
+
+
+def of_points(points):
+    points = list(points)
+    if not points:
+        return None
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return BoundingBox(min(xs), min(ys), max(xs), max(ys))
+
+
+def union(b0, b1):
+    if b0 is None:
+        return b1
+    return b0.union(b1)
+
+
+def from_view_box(view_box):
+    """
+    Builds a box from an svg viewBox value, either a "min-x min-y width height" string or a 4-tuple.
+    """
+    if isinstance(view_box, basestring):
+        view_box = [float(v) for v in view_box.replace(",", " ").split()]
+    min_x, min_y, width, height = [float(v) for v in view_box]
+    return BoundingBox(min_x, min_y, min_x + width, min_y + height)
+
+
+def clip_line(box, start, end):
+    """
+    Liang-Barsky clipping of the line start -> end against box.
+    Returns the clipped (start, end) or None if the line lies entirely outside.
+    """
+    dx = end[0] - start[0]
+    dy = end[1] - start[1]
+    t0, t1 = 0.0, 1.0
+    for p, q in ((-dx, start[0] - box.min_x), (dx, box.max_x - start[0]),
+                 (-dy, start[1] - box.min_y), (dy, box.max_y - start[1])):
+        if p == 0:
+            if q < 0:
+                return None
+            continue
+        t = q / p
+        if p < 0:
+            if t > t1:
+                return None
+            t0 = max(t0, t)
+        else:
+            if t < t0:
+                return None
+            t1 = min(t1, t)
+
+    clipped_start = (start[0] + t0 * dx, start[1] + t0 * dy) + tuple(start[2:])
+    clipped_end = (start[0] + t1 * dx, start[1] + t1 * dy) + tuple(end[2:])
+    return clipped_start, clipped_end
+
+
+class BoundingBoxTest(unittest.TestCase):
+    def testOfPoints(self):
+        b = of_points([(1, 5), (-2, 3), (4, -1)])
+        self.assertEquals((-2, -1, 4, 5), b.as_tuple())
+        self.assertIsNone(of_points([]))
+
+    def testIntersectsContains(self):
+        b = BoundingBox(0, 0, 10, 10)
+        self.assertTrue(b.intersects(BoundingBox(5, 5, 15, 15)))
+        self.assertFalse(b.intersects(BoundingBox(11, 0, 15, 10)))
+        self.assertTrue(b.contains(BoundingBox(1, 1, 9, 9)))
+        self.assertFalse(b.contains(BoundingBox(5, 5, 15, 15)))
+
+    def testFromViewBox(self):
+        self.assertEquals((10, 20, 110, 70), from_view_box("10 20 100 50").as_tuple())
+        self.assertEquals((10, 20, 110, 70), from_view_box("10,20,100,50").as_tuple())
+
+
+class ClipLineTest(unittest.TestCase):
+    def testInside(self):
+        box = BoundingBox(0, 0, 10, 10)
+        self.assertEquals(((1, 1), (9, 9)), clip_line(box, (1, 1), (9, 9)))
+
+    def testOutside(self):
+        box = BoundingBox(0, 0, 10, 10)
+        self.assertIsNone(clip_line(box, (11, 0), (11, 10)))
+        self.assertIsNone(clip_line(box, (-5, 6), (6, 17)))
+
+    def testCrossing(self):
+        box = BoundingBox(0, 0, 10, 10)
+        self.assertEquals(((0, 5), (10, 5)), clip_line(box, (-10, 5), (20, 5)))
+        self.assertEquals(((5, 0, 0), (5, 10, 0)), clip_line(box, (5, -5, 0), (5, 15, 0)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,205 @@
+"""
+Keeps pysvg, svg.path and ezdxf imported in a long running process listening on a unix socket,
+so short lived clients only pay for a socket round trip.
+
+Protocol: the client sends one json line {"layer_to_style": ..., "options": ...} followed by the svg
+and shuts down its side of the connection. The daemon answers with one json line
+{"ok": true, "debug": ...} or {"ok": false, "error": ...}, followed by the dxf on success.
+
+The socket lives in a per user directory by default. Clients only talk to, and the daemon only replaces,
+a socket owned by the current user.
+
+Only the client side is imported eagerly, the converter is imported when serving.
+"""
+from __future__ import print_function
+import errno
+import json
+import os
+import signal
+import socket
+import SocketServer
+import stat
+import StringIO
+import sys
+import threading
+import unittest
+
+
+def _default_socket():
+    if os.environ.get('SVG_TO_DXF_SOCKET'):
+        return os.environ['SVG_TO_DXF_SOCKET']
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'svg-to-dxf.sock')
+    return '/tmp/svg-to-dxf-%d.sock' % os.getuid()
+
+
+DEFAULT_SOCKET = _default_socket()
+_CHUNK_SIZE = 64 * 1024
+
+
+class DaemonUnavailable(Exception):
+    pass
+
+
+class UntrustedSocket(DaemonUnavailable):
+    """
+    Something other than a socket of the current user is at the socket path.
+    """
+    pass
+
+
+class ConversionFailed(Exception):
+    pass
+
+
+def _check_owner(socket_path):
+    try:
+        st = os.lstat(socket_path)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            raise DaemonUnavailable(socket_path)
+        raise
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        raise UntrustedSocket("%s is not a socket owned by uid %d" % (socket_path, os.getuid()))
+
+
+def _connect(socket_path):
+    _check_owner(socket_path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error as e:
+        sock.close()
+        if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+            raise DaemonUnavailable(socket_path)
+        raise
+    return sock
+
+
+def convert(svg_in, dxf_out, layer_to_style=None, debug_out=None, socket_path=DEFAULT_SOCKET, **options):
+    """
+    Same as svg_to_dxf.convert, but converts in the daemon. Raises DaemonUnavailable if none is listening,
+    UntrustedSocket, a DaemonUnavailable, if the socket is not the current user's.
+    """
+    sock = _connect(socket_path)
+    try:
+        header = {'layer_to_style': layer_to_style or {}, 'options': options}
+        sock.sendall(json.dumps(header) + "\n")
+        for chunk in iter(lambda: svg_in.read(_CHUNK_SIZE), ''):
+            sock.sendall(chunk)
+        sock.shutdown(socket.SHUT_WR)
+
+        response = sock.makefile('rb')
+        status = json.loads(response.readline())
+        if debug_out is not None and status.get('debug'):
+            debug_out.write(status['debug'])
+        if not status['ok']:
+            raise ConversionFailed(status['error'])
+
+        for chunk in iter(lambda: response.read(_CHUNK_SIZE), ''):
+            dxf_out.write(chunk)
+    finally:
+        sock.close()
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        import svg_to_dxf
+
+        header = json.loads(self.rfile.readline())
+        debug_out = StringIO.StringIO()
+        dxf_out = StringIO.StringIO()
+        try:
+            options = dict((str(k), v) for k, v in header.get('options', {}).items())
+            svg_to_dxf.convert(svg_in=self.rfile, dxf_out=dxf_out, layer_to_style=header.get('layer_to_style'),
+                               debug_out=debug_out, **options)
+        except Exception as e:
+            self.wfile.write(json.dumps({'ok': False, 'error': str(e), 'debug': debug_out.getvalue()}) + "\n")
+            return
+
+        self.wfile.write(json.dumps({'ok': True, 'debug': debug_out.getvalue()}) + "\n")
+        self.wfile.write(dxf_out.getvalue())
+
+
+class _Server(SocketServer.ForkingMixIn, SocketServer.UnixStreamServer):
+    pass
+
+
+def _remove_stale_socket(socket_path):
+    if not os.path.lexists(socket_path):
+        return
+    try:
+        _connect(socket_path).close()
+    except UntrustedSocket as e:
+        raise RuntimeError(str(e))
+    except DaemonUnavailable:
+        os.unlink(socket_path)
+        return
+    raise RuntimeError("a daemon is already listening on " + socket_path)
+
+
+def create_server(socket_path=DEFAULT_SOCKET, workers=None):
+    # imported here so forked workers start with everything loaded
+    import svg_to_dxf
+    import multiprocessing
+
+    _remove_stale_socket(socket_path)
+    server = _Server(socket_path, _Handler)
+    os.chmod(socket_path, 0o600)
+    server.max_children = workers or multiprocessing.cpu_count()
+    return server
+
+
+def serve(socket_path=DEFAULT_SOCKET, workers=None):
+    server = create_server(socket_path, workers)
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+class DaemonTest(unittest.TestCase):
+    def setUp(self):
+        import svg_to_dxf
+
+        self.socket_path = '/tmp/svg-to-dxf-test-%d.sock' % os.getpid()
+        self.svg = svg_to_dxf._TEST_SVG
+
+    def testUnavailable(self):
+        self.assertRaises(DaemonUnavailable, convert, StringIO.StringIO(self.svg), StringIO.StringIO(),
+                          socket_path=self.socket_path)
+
+    def testUntrustedSocket(self):
+        open(self.socket_path, 'w').close()
+        try:
+            self.assertRaises(UntrustedSocket, convert, StringIO.StringIO(self.svg), StringIO.StringIO(),
+                              socket_path=self.socket_path)
+            self.assertRaises(RuntimeError, create_server, self.socket_path)
+            self.assertTrue(os.path.exists(self.socket_path))
+        finally:
+            os.unlink(self.socket_path)
+
+    def testRoundTrip(self):
+        import svg_to_dxf
+
+        server = create_server(self.socket_path, workers=2)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            actual = StringIO.StringIO()
+            convert(StringIO.StringIO(self.svg), actual, layer_to_style=svg_to_dxf._TEST_LAYER_TO_STYLE,
+                    socket_path=self.socket_path)
+            self.assertEquals(svg_to_dxf._test_entities(), svg_to_dxf._entities_section(actual.getvalue()))
+            self.assertRaises(ConversionFailed, convert, StringIO.StringIO('<svg'), StringIO.StringIO(),
+                              socket_path=self.socket_path)
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+            os.unlink(self.socket_path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+from __future__ import print_function
+import unittest
+
+
+class _RecordedEntity(object):
+    def __init__(self, calls):
+        self._calls = calls
+
+    def __getattr__(self, name):
+        def record(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+
+        return record
+
+
+class EntityRecorder(object):
+    """
+    Stands in for a modelspace: add_* calls, and the calls made on the entities they return,
+    are recorded as plain tuples that can be pickled and later replayed into a real drawing.
+    """
+
+    def __init__(self):
+        self.entities = []
+
+    def __getattr__(self, name):
+        if not name.startswith('add_'):
+            raise AttributeError(name)
+
+        def add(*args, **kwargs):
+            calls = []
+            self.entities.append((name, args, kwargs, calls))
+            return _RecordedEntity(calls)
+
+        return add
+
+
+def replay(entities, msp):
+    for factory, args, kwargs, calls in entities:
+        entity = getattr(msp, factory)(*args, **kwargs)
+        for name, call_args, call_kwargs in calls:
+            getattr(entity, name)(*call_args, **call_kwargs)
+
+
+def round_values(value, precision):
+    if isinstance(value, float):
+        # adding 0.0 turns -0.0 into 0.0
+        return round(value, precision) + 0.0
+    elif isinstance(value, (tuple, list)):
+        return type(value)(round_values(v, precision) for v in value)
+    return value
+
+
+class _RoundingProxy(object):
+    def __init__(self, target, precision):
+        self._target = target
+        self._precision = precision
+
+    def __getattr__(self, name):
+        method = getattr(self._target, name)
+
+        def call(*args, **kwargs):
+            args = round_values(args, self._precision)
+            kwargs = dict((k, round_values(v, self._precision)) for k, v in kwargs.items())
+            return _RoundingProxy(method(*args, **kwargs), self._precision)
+
+        return call
+
+
+def rounding_modelspace(msp, precision):
+    """
+    Wraps msp so that coordinates given to add_* and to the entities they return are rounded to precision decimals.
+    """
+    return _RoundingProxy(msp, precision)
+
+
+class _FakeEntity(object):
+    def __init__(self, log, factory):
+        self.log = log
+        self.factory = factory
+
+    def set_dxf_attrib(self, key, value):
+        self.log.append((self.factory, 'set_dxf_attrib', key, value))
+
+
+class _FakeModelspace(object):
+    def __init__(self):
+        self.log = []
+
+    def add_line(self, start, end):
+        self.log.append(('add_line', start, end))
+        return _FakeEntity(self.log, 'add_line')
+
+
+class EntityRecorderTest(unittest.TestCase):
+    def testReplay(self):
+        recorder = EntityRecorder()
+        recorder.add_line(start=(0, 0), end=(1, 1)).set_dxf_attrib('layer', 'a')
+        recorder.add_line(start=(1, 1), end=(2, 2))
+
+        msp = _FakeModelspace()
+        replay(recorder.entities, msp)
+        self.assertEquals([('add_line', (0, 0), (1, 1)),
+                           ('add_line', 'set_dxf_attrib', 'layer', 'a'),
+                           ('add_line', (1, 1), (2, 2))], msp.log)
+
+    def testRounding(self):
+        msp = _FakeModelspace()
+        rounding_modelspace(msp, 2).add_line(start=(0.123, -0.001), end=(1, 2.5)).set_dxf_attrib('layer', 'a')
+        self.assertEquals([('add_line', (0.12, 0.0), (1, 2.5)),
+                           ('add_line', 'set_dxf_attrib', 'layer', 'a')], msp.log)
+        self.assertEquals('0.0', repr(msp.log[0][1][1]))
+
+    def testOnlyRecordsAdd(self):
+        self.assertRaises(AttributeError, getattr, EntityRecorder(), 'layers')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,382 @@
+"""
+A persistent job queue for conversions too large to run within one http request.
+
+Every job is a directory holding the svg, the conversion arguments, its status and, once done,
+the dxf. Jobs left queued or running by a previous process are queued again on start.
+Jobs run in a process pool; a running job notices cancellation and writes its progress at most
+every PROGRESS_INTERVAL seconds. It also touches a heartbeat file every HEARTBEAT_INTERVAL seconds,
+a running job whose heartbeat is older than HEARTBEAT_TIMEOUT lost its worker and is failed.
+"""
+from __future__ import print_function
+import json
+import multiprocessing
+import os
+import shutil
+import StringIO
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+PROGRESS_INTERVAL = 0.5
+HEARTBEAT_INTERVAL = 5
+HEARTBEAT_TIMEOUT = 30
+EXPIRE_INTERVAL = 60
+
+_INPUT = 'input.svg'
+_ARGUMENTS = 'arguments.json'
+_STATUS = 'status.json'
+_OUTPUT = 'output.dxf'
+_CANCEL = 'cancel'
+_HEARTBEAT = 'heartbeat'
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _write_json(path, value):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(value, f)
+    os.rename(tmp, path)
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _touch(path):
+    with open(path, 'a'):
+        os.utime(path, None)
+
+
+def _beat(heartbeat_path, stopped):
+    while not stopped.wait(HEARTBEAT_INTERVAL):
+        _touch(heartbeat_path)
+
+
+def _run_job(job_dir):
+    import svg_to_dxf
+
+    status_path = os.path.join(job_dir, _STATUS)
+    cancel_path = os.path.join(job_dir, _CANCEL)
+    status = _read_json(status_path)
+    # queued twice, e.g. by a restart, or failed for a stale heartbeat
+    if status['state'] in FINISHED_STATES:
+        return
+
+    def update(**changes):
+        status.update(changes)
+        _write_json(status_path, status)
+
+    if os.path.exists(cancel_path):
+        update(state=CANCELLED, finished=time.time())
+        return
+
+    heartbeat_path = os.path.join(job_dir, _HEARTBEAT)
+    _touch(heartbeat_path)
+    update(state=RUNNING, started=time.time())
+    last_update = [0]
+
+    def progress(processed, total):
+        now = time.time()
+        if now - last_update[0] < PROGRESS_INTERVAL and processed < total:
+            return
+        last_update[0] = now
+        if os.path.exists(cancel_path):
+            raise JobCancelled()
+        update(processed=processed, total=total)
+
+    arguments = _read_json(os.path.join(job_dir, _ARGUMENTS))
+    options = dict((str(k), v) for k, v in arguments['options'].items())
+    output_path = os.path.join(job_dir, _OUTPUT)
+    stopped = threading.Event()
+    heartbeat = threading.Thread(target=_beat, args=(heartbeat_path, stopped))
+    heartbeat.daemon = True
+    heartbeat.start()
+    try:
+        with open(os.path.join(job_dir, _INPUT), 'rb') as svg_in, open(output_path + '.part', 'wb') as dxf_out:
+            svg_to_dxf.convert(svg_in=svg_in, dxf_out=dxf_out, layer_to_style=arguments['layer_to_style'],
+                               progress=progress, **options)
+        # cancelled after the last progress update
+        if os.path.exists(cancel_path):
+            raise JobCancelled()
+        os.rename(output_path + '.part', output_path)
+    except JobCancelled:
+        _remove(output_path + '.part')
+        update(state=CANCELLED, finished=time.time())
+    except Exception as e:
+        _remove(output_path + '.part')
+        update(state=FAILED, error=str(e), finished=time.time())
+    else:
+        update(state=DONE, finished=time.time())
+    finally:
+        stopped.set()
+
+
+class JobQueue(object):
+    """
+    Finished jobs are removed expiry seconds after they finished, checked every EXPIRE_INTERVAL seconds.
+    Jobs run in pool if given, otherwise in a pool of workers processes owned by the queue.
+    """
+
+    def __init__(self, directory, workers=None, expiry=3600, pool=None):
+        self.directory = directory
+        self.expiry = expiry
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._owns_pool = pool is None
+        self._pool = multiprocessing.Pool(workers) if pool is None else pool
+        self._recover()
+        self._closed = threading.Event()
+        expirer = threading.Thread(target=self._expire_periodically)
+        expirer.daemon = True
+        expirer.start()
+
+    def _job_dir(self, job_id):
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            raise KeyError(job_id)
+        return os.path.join(self.directory, job_id)
+
+    def _recover(self):
+        for job_id in sorted(os.listdir(self.directory), key=lambda j: self._created(j)):
+            try:
+                status = self._read_status(job_id)
+            except KeyError:
+                continue
+            if status['state'] not in FINISHED_STATES:
+                if status['state'] == RUNNING:
+                    status['state'] = QUEUED
+                    status.pop('started', None)
+                    _write_json(os.path.join(self._job_dir(job_id), _STATUS), status)
+                self._pool.apply_async(_run_job, (self._job_dir(job_id),))
+
+    def _created(self, job_id):
+        try:
+            return _read_json(os.path.join(self.directory, job_id, _STATUS))['created']
+        except (IOError, ValueError, KeyError):
+            return 0
+
+    def submit(self, svg_in, layer_to_style=None, options=None):
+        """
+        Queues the conversion of the svg read from svg_in and returns the job id.
+        options are ConvertOptions keyword arguments and must be json serializable.
+        """
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.directory, job_id)
+        os.mkdir(job_dir)
+        with open(os.path.join(job_dir, _INPUT), 'wb') as f:
+            shutil.copyfileobj(svg_in, f)
+        _write_json(os.path.join(job_dir, _ARGUMENTS), {'layer_to_style': layer_to_style or {},
+                                                        'options': options or {}})
+        _write_json(os.path.join(job_dir, _STATUS), {'id': job_id, 'state': QUEUED, 'created': time.time(),
+                                                     'processed': 0, 'total': None})
+
+        self._pool.apply_async(_run_job, (job_dir,))
+        return job_id
+
+    def _read_status(self, job_id):
+        try:
+            return _read_json(os.path.join(self._job_dir(job_id), _STATUS))
+        except (IOError, ValueError):
+            raise KeyError(job_id)
+
+    def status(self, job_id):
+        """
+        Raises KeyError for unknown or expired jobs.
+        A job cancelled while finishing reports cancelled, even if it went on to write its result.
+        """
+        status = self._read_status(job_id)
+        job_dir = self._job_dir(job_id)
+        if status['state'] in (QUEUED, RUNNING, DONE) and os.path.exists(os.path.join(job_dir, _CANCEL)):
+            status['state'] = CANCELLED
+        elif status['state'] == RUNNING and self._heartbeat_age(job_dir, status) > HEARTBEAT_TIMEOUT:
+            status.update(state=FAILED, error="the worker running the job died", finished=time.time())
+            _write_json(os.path.join(job_dir, _STATUS), status)
+        return status
+
+    # noinspection PyMethodMayBeStatic
+    def _heartbeat_age(self, job_dir, status):
+        try:
+            last_beat = os.path.getmtime(os.path.join(job_dir, _HEARTBEAT))
+        except OSError:
+            last_beat = status.get('started', status['created'])
+        return time.time() - last_beat
+
+    def result_path(self, job_id):
+        """
+        Path of the dxf of a done job, None if the job is not done.
+        """
+        if self.status(job_id)['state'] != DONE:
+            return None
+        return os.path.join(self._job_dir(job_id), _OUTPUT)
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued or running job, removes a finished one.
+        """
+        status = self.status(job_id)
+        job_dir = self._job_dir(job_id)
+        if status['state'] in FINISHED_STATES:
+            shutil.rmtree(job_dir, ignore_errors=True)
+        else:
+            open(os.path.join(job_dir, _CANCEL), 'w').close()
+
+    def expire(self):
+        now = time.time()
+        for job_id in os.listdir(self.directory):
+            try:
+                status = self.status(job_id)
+            except KeyError:
+                continue
+            if status['state'] in FINISHED_STATES and now - status.get('finished', now) > self.expiry:
+                shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+
+    def _expire_periodically(self):
+        while not self._closed.wait(EXPIRE_INTERVAL):
+            self.expire()
+
+    def close(self):
+        self._closed.set()
+        if self._owns_pool:
+            self._pool.terminate()
+            self._pool.join()
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        import svg_to_dxf
+
+        self.svg = svg_to_dxf._TEST_SVG
+        self.directory = tempfile.mkdtemp()
+        self.queue = JobQueue(self.directory, workers=1, expiry=3600)
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.directory)
+
+    def _wait(self, job_id):
+        for _ in range(200):
+            status = self.queue.status(job_id)
+            if status['state'] in FINISHED_STATES:
+                return status
+            time.sleep(0.05)
+        self.fail("job did not finish")
+
+    def testDone(self):
+        import svg_to_dxf
+
+        job_id = self.queue.submit(StringIO.StringIO(self.svg), svg_to_dxf._TEST_LAYER_TO_STYLE)
+        status = self._wait(job_id)
+        self.assertEquals(DONE, status['state'])
+        self.assertEquals(13, status['processed'])
+        self.assertEquals(13, status['total'])
+        with open(self.queue.result_path(job_id)) as f:
+            self.assertEquals(svg_to_dxf._test_entities(), svg_to_dxf._entities_section(f.read()))
+
+        self.queue.expiry = -1
+        self.queue.expire()
+        self.assertRaises(KeyError, self.queue.status, job_id)
+
+    def testFailed(self):
+        job_id = self.queue.submit(StringIO.StringIO('<svg'))
+        self.assertEquals(FAILED, self._wait(job_id)['state'])
+        self.assertIsNone(self.queue.result_path(job_id))
+
+    def testCancelQueued(self):
+        job_dir = os.path.join(self.directory, 'abc')
+        os.mkdir(job_dir)
+        _write_json(os.path.join(job_dir, _STATUS), {'id': 'abc', 'state': QUEUED, 'created': 0})
+        self.queue.cancel('abc')
+        self.assertEquals(CANCELLED, self.queue.status('abc')['state'])
+        _run_job(job_dir)
+        self.assertEquals(CANCELLED, self.queue.status('abc')['state'])
+
+        self.assertRaises(KeyError, self.queue.status, '../etc')
+
+    def _job(self, job_id, state):
+        job_dir = os.path.join(self.directory, job_id)
+        os.mkdir(job_dir)
+        with open(os.path.join(job_dir, _INPUT), 'wb') as f:
+            f.write(self.svg)
+        _write_json(os.path.join(job_dir, _ARGUMENTS), {'layer_to_style': {}, 'options': {}})
+        _write_json(os.path.join(job_dir, _STATUS), {'id': job_id, 'state': state, 'created': 0})
+        return job_dir
+
+    def testCancelAfterLastProgress(self):
+        import svg_to_dxf
+
+        job_dir = self._job('abd', QUEUED)
+        convert = svg_to_dxf.convert
+
+        def convert_then_cancel(*args, **kwargs):
+            convert(*args, **kwargs)
+            self.queue.cancel('abd')
+
+        svg_to_dxf.convert = convert_then_cancel
+        try:
+            _run_job(job_dir)
+        finally:
+            svg_to_dxf.convert = convert
+        self.assertEquals(CANCELLED, self.queue.status('abd')['state'])
+        self.assertIsNone(self.queue.result_path('abd'))
+        self.assertEquals([], [f for f in os.listdir(job_dir) if f.startswith(_OUTPUT)])
+
+    def testWorkerDied(self):
+        job_dir = self._job('abe', RUNNING)
+        heartbeat_path = os.path.join(job_dir, _HEARTBEAT)
+        _touch(heartbeat_path)
+        self.assertEquals(RUNNING, self.queue.status('abe')['state'])
+
+        stale = time.time() - HEARTBEAT_TIMEOUT - 1
+        os.utime(heartbeat_path, (stale, stale))
+        self.assertEquals(FAILED, self.queue.status('abe')['state'])
+        self.assertEquals(FAILED, _read_json(os.path.join(job_dir, _STATUS))['state'])
+
+        # a worker that only picks the job up now does not run it anymore
+        _run_job(job_dir)
+        self.assertEquals(FAILED, self.queue.status('abe')['state'])
+        self.assertIsNone(self.queue.result_path('abe'))
+
+    def testRecoverRunning(self):
+        job_dir = self._job('abf', RUNNING)
+        stale = time.time() - HEARTBEAT_TIMEOUT - 1
+        _touch(os.path.join(job_dir, _HEARTBEAT))
+        os.utime(os.path.join(job_dir, _HEARTBEAT), (stale, stale))
+
+        queued = []
+
+        class Pool(object):
+            # noinspection PyMethodMayBeStatic
+            def apply_async(self, func, args):
+                queued.append(args)
+
+        queue = JobQueue(self.directory, pool=Pool())
+        try:
+            self.assertEquals([(job_dir,)], queued)
+            self.assertEquals(QUEUED, queue.status('abf')['state'])
+            _run_job(job_dir)
+            self.assertEquals(DONE, queue.status('abf')['state'])
+        finally:
+            queue.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
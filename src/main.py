@@ -1,6 +1,13 @@
-import svg_to_dxf as std
 import sys
+import conversion_daemon
 
 
 if __name__ == "__main__":
-    std.convert(svg_in=sys.stdin, dxf_out=sys.stdout, layer_to_style={}, debug_out=sys.stderr)
+    if sys.argv[1:2] == ["--daemon"]:
+        conversion_daemon.serve()
+    else:
+        try:
+            conversion_daemon.convert(svg_in=sys.stdin, dxf_out=sys.stdout, layer_to_style={}, debug_out=sys.stderr)
+        except conversion_daemon.DaemonUnavailable:
+            import svg_to_dxf as std
+            std.convert(svg_in=sys.stdin, dxf_out=sys.stdout, layer_to_style={}, debug_out=sys.stderr)
@@ -0,0 +1,217 @@
+"""
+A minimal DXF R12 (AC1009) writer, standing in for the ezdxf drawing where output size matters.
+
+It writes only a LTYPE and a LAYER table followed by the entities: no header, blocks or handles,
+and no group codes holding default values. R12 has neither splines nor lightweight polylines,
+both are written as POLYLINEs, splines flattened to within the drawing's tolerance.
+"""
+from __future__ import division, print_function
+import math
+import StringIO
+import unittest
+
+import entities as entities
+
+VERSION = 'AC1009'
+# flattening keeps to the tolerance only as far as MAX_SEGMENTS segments per curve allow
+MAX_SEGMENTS = 1024
+MIN_TOLERANCE = 1e-6
+
+
+def _format(value):
+    if isinstance(value, float):
+        if value == int(value):
+            return str(int(value))
+        return repr(value)
+    return str(value)
+
+
+class Layer(object):
+    def __init__(self, name):
+        self.name = name
+        self.color = 7
+
+    def set_color(self, color):
+        self.color = color
+
+
+class _Layers(object):
+    def __init__(self):
+        self._layers = []
+
+    # noinspection PyUnusedLocal
+    def create(self, name, dxfattribs=None):
+        layer = Layer(name)
+        self._layers.append(layer)
+        return layer
+
+    def __iter__(self):
+        return iter(self._layers)
+
+
+class _Entity(object):
+    def __init__(self, dxftype, points):
+        self.dxftype = dxftype
+        self.points = points
+        self.layer = '0'
+
+    def set_dxf_attrib(self, key, value):
+        if key == 'layer':
+            self.layer = value
+
+    def set_control_points(self, points):
+        self.points = list(points)
+
+    # noinspection PyUnusedLocal
+    def set_knot_values(self, values):
+        # splines are always cubic beziers, clamped on 0 and 1
+        pass
+
+
+class Modelspace(object):
+    def __init__(self):
+        self.entities = []
+
+    def _add(self, dxftype, points):
+        entity = _Entity(dxftype, points)
+        self.entities.append(entity)
+        return entity
+
+    def add_line(self, start, end):
+        return self._add('LINE', [start, end])
+
+    def add_lwpolyline(self, points):
+        return self._add('POLYLINE', list(points))
+
+    def add_spline(self):
+        return self._add('SPLINE', [])
+
+    def delete_all_entities(self):
+        self.entities = []
+
+
+def _write_tags(stream, *pairs):
+    for code, value in pairs:
+        stream.write("%d\n%s\n" % (code, _format(value)))
+
+
+class _EntitiesSection(object):
+    def __init__(self, drawing):
+        self._drawing = drawing
+
+    def write(self, stream):
+        _write_tags(stream, (0, 'SECTION'), (2, 'ENTITIES'))
+        for entity in self._drawing.modelspace().entities:
+            if entity.dxftype == 'LINE':
+                (x1, y1), (x2, y2) = entity.points[0][:2], entity.points[1][:2]
+                _write_tags(stream, (0, 'LINE'), (8, entity.layer), (10, x1), (20, y1), (11, x2), (21, y2))
+                continue
+
+            points = entity.points
+            if entity.dxftype == 'SPLINE':
+                points = flatten_bezier(points, self._drawing.tolerance)
+                if self._drawing.precision is not None:
+                    points = entities.round_values(points, self._drawing.precision)
+            _write_tags(stream, (0, 'POLYLINE'), (8, entity.layer), (66, 1), (10, 0), (20, 0))
+            for point in points:
+                _write_tags(stream, (0, 'VERTEX'), (8, entity.layer), (10, point[0]), (20, point[1]))
+            _write_tags(stream, (0, 'SEQEND'))
+        _write_tags(stream, (0, 'ENDSEC'))
+
+
+def _bezier_point(p, t):
+    mt = 1 - t
+    a, b, c, d = mt * mt * mt, 3 * mt * mt * t, 3 * mt * t * t, t * t * t
+    return (a * p[0][0] + b * p[1][0] + c * p[2][0] + d * p[3][0],
+            a * p[0][1] + b * p[1][1] + c * p[2][1] + d * p[3][1])
+
+
+def flatten_bezier(control_points, tolerance):
+    """
+    Approximates a cubic bezier by points whose polyline deviates at most tolerance from the curve,
+    using no more than MAX_SEGMENTS segments.
+    """
+    p = control_points
+    deviation = max(math.hypot(p[i][0] - 2 * p[i + 1][0] + p[i + 2][0], p[i][1] - 2 * p[i + 1][1] + p[i + 2][1])
+                    for i in (0, 1))
+    segments = min(math.ceil(math.sqrt(0.75 * deviation / tolerance)), MAX_SEGMENTS) if deviation > 0 else 1
+    segments = max(int(segments), 1)
+    return [_bezier_point(p, i / segments) for i in range(segments + 1)]
+
+
+class Drawing(object):
+    """
+    Used like an ezdxf drawing: layers.create(name), modelspace().add_*, entities.write(stream) for the
+    ENTITIES section alone and write(stream).
+    The points of flattened splines are rounded to precision decimals, if given.
+    """
+
+    def __init__(self, tolerance=0.1, precision=None):
+        self.tolerance = tolerance
+        self.precision = precision
+        self.layers = _Layers()
+        self._modelspace = Modelspace()
+        self.entities = _EntitiesSection(self)
+
+    def modelspace(self):
+        return self._modelspace
+
+    def write(self, stream):
+        layers = list(self.layers)
+        _write_tags(stream, (0, 'SECTION'), (2, 'TABLES'),
+                    (0, 'TABLE'), (2, 'LTYPE'), (70, 1),
+                    (0, 'LTYPE'), (2, 'CONTINUOUS'), (70, 0), (3, ''), (72, 65), (73, 0), (40, 0),
+                    (0, 'ENDTAB'),
+                    (0, 'TABLE'), (2, 'LAYER'), (70, len(layers)))
+        for layer in layers:
+            _write_tags(stream, (0, 'LAYER'), (2, layer.name), (70, 0), (62, layer.color), (6, 'CONTINUOUS'))
+        _write_tags(stream, (0, 'ENDTAB'), (0, 'ENDSEC'))
+        self.entities.write(stream)
+        _write_tags(stream, (0, 'EOF'))
+
+
+class DrawingTest(unittest.TestCase):
+    def testWrite(self):
+        dwg = Drawing()
+        dwg.layers.create(name='cut').set_color(1)
+        msp = dwg.modelspace()
+        msp.add_line(start=(0.0, 0.5), end=(1.25, -2.0)).set_dxf_attrib('layer', 'cut')
+        out = StringIO.StringIO()
+        dwg.write(out)
+
+        dxf = out.getvalue()
+        self.assertIn("0\nLAYER\n2\ncut\n70\n0\n62\n1\n", dxf)
+        self.assertIn("0\nLINE\n8\ncut\n10\n0\n20\n0.5\n11\n1.25\n21\n-2\n", dxf)
+        self.assertTrue(dxf.endswith("0\nENDSEC\n0\nEOF\n"))
+
+    def testPrecision(self):
+        dwg = Drawing(tolerance=0.001, precision=2)
+        spline = dwg.modelspace().add_spline()
+        spline.set_control_points([(0, 0, 0), (0, 10, 0), (10, 10, 0), (10, 0, 0)])
+        out = StringIO.StringIO()
+        dwg.write(out)
+
+        tags = out.getvalue().split("\n")
+        coordinates = [value for code, value in zip(tags[0::2], tags[1::2]) if code in ('10', '20')]
+        self.assertGreater(len(coordinates), 20)
+        for value in coordinates:
+            self.assertLessEqual(len(value.partition('.')[2]), 2, value)
+
+    def testFlattenBezier(self):
+        line = flatten_bezier([(0, 0), (1, 0), (2, 0), (3, 0)], 0.01)
+        self.assertEquals([(0, 0), (3, 0)], line)
+
+        points = flatten_bezier([(0, 0), (0, 10), (10, 10), (10, 0)], 0.01)
+        self.assertEquals((0, 0), points[0])
+        self.assertEquals((10, 0), points[-1])
+        for i in range(len(points) - 1):
+            t = (i + 0.5) / (len(points) - 1)
+            mid = ((points[i][0] + points[i + 1][0]) / 2, (points[i][1] + points[i + 1][1]) / 2)
+            on_curve = _bezier_point([(0, 0), (0, 10), (10, 10), (10, 0)], t)
+            self.assertLess(math.hypot(mid[0] - on_curve[0], mid[1] - on_curve[1]), 0.02)
+
+        self.assertEquals(MAX_SEGMENTS + 1, len(flatten_bezier([(0, 0), (0, 1e300), (10, 10), (10, 0)], 1e-300)))
+
+
+if __name__ == "__main__":
+    unittest.main()
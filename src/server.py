@@ -1,14 +1,113 @@
 from __future__ import print_function
+import collections
+import json
+import multiprocessing
+import os
+import StringIO
 import sys
+import tempfile
+import threading
+import unittest
 import web
-import StringIO
 from version import version as api_version
-from svg_to_dxf import convert as std_convert
+from svg_to_dxf import convert as std_convert, ConvertOptions, ConversionCache
+import jobs
+import batch
 
 urls = (
-    '/', 'convert_svg'
+    '/', 'convert_svg',
+    '/jobs', 'convert_jobs',
+    '/jobs/([0-9a-f]+)', 'convert_job',
+    '/jobs/([0-9a-f]+)/dxf', 'convert_job_dxf',
+    '/batch', 'convert_batch',
 )
 
+# query parameters that are conversion options rather than layer styles
+_option_names = ('cull', 'cull_region', 'session', 'compact', 'precision', 'dxf_version', 'tolerance')
+
+# request bodies larger than this are rejected, smaller ones are kept in memory up to SPOOL_SIZE
+MAX_BODY_SIZE = int(os.environ.get('SVG_TO_DXF_MAX_BODY_SIZE', 256 * 1024 * 1024))
+SPOOL_SIZE = int(os.environ.get('SVG_TO_DXF_SPOOL_SIZE', 1024 * 1024))
+# batch archives whose files hold more than this once decompressed are rejected
+MAX_ARCHIVE_SIZE = int(os.environ.get('SVG_TO_DXF_MAX_ARCHIVE_SIZE', 256 * 1024 * 1024))
+_CHUNK_SIZE = 64 * 1024
+
+# conversion caches of the most recently used editing sessions
+CACHE_SESSIONS = int(os.environ.get('SVG_TO_DXF_CACHE_SESSIONS', 32))
+
+_worker_pool = None
+_job_queue = None
+_session_caches = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def worker_pool():
+    global _worker_pool
+    with _lock:
+        if _worker_pool is None:
+            _worker_pool = multiprocessing.Pool(int(os.environ.get('SVG_TO_DXF_WORKERS', 0)) or None)
+        return _worker_pool
+
+
+def session_cache(session):
+    """
+    Returns the (lock, ConversionCache) of session, the lock is to be held while converting with the cache.
+    """
+    with _lock:
+        entry = _session_caches.pop(session, None) or (threading.Lock(), ConversionCache())
+        _session_caches[session] = entry
+        while len(_session_caches) > CACHE_SESSIONS:
+            _session_caches.popitem(last=False)
+        return entry
+
+
+def job_queue():
+    global _job_queue
+    pool = worker_pool()
+    with _lock:
+        if _job_queue is None:
+            _job_queue = jobs.JobQueue(os.environ.get('SVG_TO_DXF_JOBS', '/tmp/svg-to-dxf-jobs'),
+                                       expiry=int(os.environ.get('SVG_TO_DXF_JOB_EXPIRY', 3600)), pool=pool)
+        return _job_queue
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+def _check_body_size():
+    if web.intget(web.ctx.env.get('CONTENT_LENGTH'), 0) > MAX_BODY_SIZE:
+        raise _BodyTooLarge()
+
+
+def _spool_body():
+    """
+    Copies the request body into a temporary file, kept in memory up to SPOOL_SIZE, positioned at its start.
+    """
+    _check_body_size()
+    remaining = web.intget(web.ctx.env.get('CONTENT_LENGTH'), 0)
+    wsgi_input = web.ctx.env['wsgi.input']
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    while remaining > 0:
+        chunk = wsgi_input.read(min(remaining, _CHUNK_SIZE))
+        if not chunk:
+            break
+        body.write(chunk)
+        remaining -= len(chunk)
+    body.seek(0)
+    return body
+
+
+def _too_large(message=None):
+    return web.HTTPError("413 Request Entity Too Large", {},
+                         message or "request body exceeds %d bytes" % MAX_BODY_SIZE)
+
+
+def _json(value):
+    web.header("Content-Type", "application/json")
+    web.header("Service-Version", api_version)
+    return json.dumps(value)
+
 
 class convert_svg(object):
     def _common(self):
@@ -22,27 +121,73 @@ class convert_svg(object):
     def POST(self):
         self._common()
         try:
-            svg = web.data()
             layer_to_style = self._parse_layer_styles()
+            options = self._parse_options()
+        except ValueError:
+            return web.badrequest()
 
-            if svg:
-                svg_in = StringIO.StringIO(svg)
-                dxf_out = StringIO.StringIO()
-                std_convert(svg_in=svg_in, dxf_out=dxf_out, layer_to_style=layer_to_style, debug_out=None)
-                web.header("Content-Type", "application/dxf")
-                web.header("Service-Version", api_version)
-                return dxf_out.getvalue()
-            else:
-                return ""
+        try:
+            svg_in = _spool_body()
+            with svg_in:
+                if svg_in.read(1):
+                    svg_in.seek(0)
+                    dxf_out = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+                    session = self._params().get('session')
+                    if session:
+                        lock, options.cache = session_cache(session)
+                        with lock:
+                            std_convert(svg_in=svg_in, dxf_out=dxf_out, layer_to_style=layer_to_style,
+                                        debug_out=None, options=options)
+                            web.header("Cache-Hits", str(options.cache.hits))
+                            web.header("Cache-Misses", str(options.cache.misses))
+                    else:
+                        std_convert(svg_in=svg_in, dxf_out=dxf_out, layer_to_style=layer_to_style, debug_out=None,
+                                    options=options)
+                    web.header("Content-Type", "application/dxf")
+                    web.header("Content-Length", str(dxf_out.tell()))
+                    web.header("Service-Version", api_version)
+                    dxf_out.seek(0)
+                    return _stream(dxf_out)
+                else:
+                    return ""
+
+        except _BodyTooLarge:
+            return _too_large()
 
         except Exception, e:
             print(str(e), file=sys.stderr)
             return web.internalerror(str(e))
 
     # noinspection PyMethodMayBeStatic
+    def _params(self):
+        # the body is the svg, or holds the files of a batch
+        return web.input(_method='get')
+
+    def _parse_option_kwargs(self):
+        """
+        Raises ValueError for invalid options.
+        """
+        params = self._params()
+        cull = params.get('cull', '').lower() in ('1', 'true', 'yes')
+        cull_region = params.get('cull_region', '').strip() or None
+        compact = params.get('compact', '').lower() in ('1', 'true', 'yes')
+        precision = int(params['precision']) if params.get('precision', '').strip() else None
+        dxf_version = params.get('dxf_version', '').strip() or None
+        kwargs = {'cull': cull, 'cull_region': cull_region, 'compact': compact, 'precision': precision,
+                  'dxf_version': dxf_version}
+        if params.get('tolerance', '').strip():
+            kwargs['tolerance'] = float(params['tolerance'])
+        ConvertOptions(**kwargs)
+        return kwargs
+
+    def _parse_options(self):
+        return ConvertOptions(**self._parse_option_kwargs())
+
     def _parse_layer_styles(self):
         layer_to_style = {}
-        for layer, s in web.input().items():
+        for layer, s in self._params().items():
+            if layer in _option_names:
+                continue
             layer_styles = [e.strip() for e in s.split(',') if e.strip()]
             if layer_styles:
                 layer_to_style[layer] = {}
@@ -54,6 +199,196 @@ class convert_svg(object):
         return layer_to_style
 
 
+class convert_jobs(convert_svg):
+    def GET(self):
+        return web.nomethod()
+
+    def POST(self):
+        self._common()
+        try:
+            layer_to_style = self._parse_layer_styles()
+            option_kwargs = self._parse_option_kwargs()
+        except ValueError:
+            return web.badrequest()
+
+        try:
+            with _spool_body() as svg_in:
+                if not svg_in.read(1):
+                    return web.badrequest()
+
+                svg_in.seek(0)
+                job_id = job_queue().submit(svg_in, layer_to_style, option_kwargs)
+            web.ctx.status = "202 Accepted"
+            return _json({'id': job_id})
+
+        except _BodyTooLarge:
+            return _too_large()
+
+        except Exception, e:
+            print(str(e), file=sys.stderr)
+            return web.internalerror(str(e))
+
+
+class convert_job(convert_svg):
+    def GET(self, job_id):
+        self._common()
+        try:
+            return _json(job_queue().status(job_id))
+        except KeyError:
+            return web.notfound()
+
+    def POST(self, job_id):
+        return web.nomethod()
+
+    def DELETE(self, job_id):
+        self._common()
+        try:
+            job_queue().cancel(job_id)
+        except KeyError:
+            return web.notfound()
+        return ""
+
+
+class convert_job_dxf(convert_svg):
+    def GET(self, job_id):
+        self._common()
+        try:
+            result_path = job_queue().result_path(job_id)
+            dxf = open(result_path, 'rb') if result_path is not None else None
+        except (KeyError, IOError):
+            return web.notfound()
+        if dxf is None:
+            return web.conflict()
+
+        web.header("Content-Type", "application/dxf")
+        web.header("Service-Version", api_version)
+        return _stream(dxf)
+
+    def POST(self, job_id):
+        return web.nomethod()
+
+
+class convert_batch(convert_svg):
+    """
+    Takes a zip or tar of svgs, or a multipart upload of svg files, and answers with a zip of dxfs.
+    Query parameters are shared by all files, per file layer styles are read from a layer_styles.json
+    archive member or multipart field.
+    """
+
+    def GET(self):
+        return web.nomethod()
+
+    def POST(self):
+        self._common()
+        try:
+            layer_to_style = self._parse_layer_styles()
+            option_kwargs = self._parse_option_kwargs()
+            if web.ctx.env.get('CONTENT_TYPE', '').lower().startswith('multipart/'):
+                _check_body_size()
+                files, per_file_styles = self._read_multipart()
+            else:
+                with _spool_body() as archive:
+                    files, per_file_styles = batch.read_archive(archive, MAX_ARCHIVE_SIZE)
+        except _BodyTooLarge:
+            return _too_large()
+        except batch.ArchiveTooLarge as e:
+            return _too_large(str(e))
+        except (batch.UnsupportedArchive, ValueError):
+            return web.badrequest()
+
+        if not files:
+            return web.badrequest()
+
+        web.header("Content-Type", "application/zip")
+        web.header("Content-Disposition", 'attachment; filename="dxf.zip"')
+        web.header("Service-Version", api_version)
+        return batch.convert_all(worker_pool(), files, layer_to_style, per_file_styles, option_kwargs)
+
+    # noinspection PyMethodMayBeStatic
+    def _read_multipart(self):
+        files = []
+        per_file_styles = {}
+        for name, value in web.webapi.rawinput(method='post').items():
+            for field in value if isinstance(value, list) else [value]:
+                if name == 'layer_styles':
+                    per_file_styles = batch.parse_per_file_styles(
+                        field if isinstance(field, basestring) else field.value)
+                elif not isinstance(field, basestring):
+                    files.append((field.filename, field.value))
+        return files, per_file_styles
+
+
+def _stream(f, chunk_size=_CHUNK_SIZE):
+    with f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            yield chunk
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        import svg_to_dxf
+
+        self.app = web.application(urls, globals())
+        self.svg = svg_to_dxf._TEST_SVG
+
+    def testInvalidOptions(self):
+        for path in ('/?precision=abc', '/?cull_region=bad', '/?tolerance=x', '/?tolerance=0',
+                     '/?tolerance=1e-300', '/?tolerance=inf', '/?dxf_version=foo',
+                     '/jobs?precision=abc', '/batch?precision=x'):
+            response = self.app.request(path, method='POST', data=self.svg)
+            self.assertEquals('400 Bad Request', response.status, path)
+
+    def testStreamedResponse(self):
+        import svg_to_dxf
+
+        global SPOOL_SIZE
+        spool_size, SPOOL_SIZE = SPOOL_SIZE, 64
+        try:
+            response = self.app.request('/?cut=color:%23ff0000', method='POST', data=self.svg)
+        finally:
+            SPOOL_SIZE = spool_size
+
+        self.assertEquals('200 OK', response.status)
+        self.assertEquals(str(len(response.data)), response.headers['Content-Length'])
+        self.assertEquals(svg_to_dxf._test_entities(), svg_to_dxf._entities_section(response.data))
+
+    def testBodyTooLarge(self):
+        global MAX_BODY_SIZE
+        max_body_size, MAX_BODY_SIZE = MAX_BODY_SIZE, len(self.svg) - 1
+        try:
+            for path in ('/', '/jobs', '/batch'):
+                response = self.app.request(path, method='POST', data=self.svg)
+                self.assertEquals('413 Request Entity Too Large', response.status, path)
+        finally:
+            MAX_BODY_SIZE = max_body_size
+
+    def _zip(self, *members):
+        import zipfile
+
+        data = StringIO.StringIO()
+        with zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, content in members:
+                archive.writestr(name, content)
+        return data.getvalue()
+
+    def testBatchInvalidLayerStyles(self):
+        for layer_styles in ('[]', '{"a.svg": "cut"}', '{"a.svg": {"cut": 1}}'):
+            data = self._zip(('a.svg', self.svg), (batch.LAYER_STYLES_NAME, layer_styles))
+            response = self.app.request('/batch', method='POST', data=data)
+            self.assertEquals('400 Bad Request', response.status, layer_styles)
+
+    def testBatchArchiveTooLarge(self):
+        global MAX_ARCHIVE_SIZE
+        data = self._zip(('a.svg', self.svg), ('b.svg', self.svg))
+        max_archive_size, MAX_ARCHIVE_SIZE = MAX_ARCHIVE_SIZE, 2 * len(self.svg) - 1
+        try:
+            response = self.app.request('/batch', method='POST', data=data)
+        finally:
+            MAX_ARCHIVE_SIZE = max_archive_size
+        self.assertEquals('413 Request Entity Too Large', response.status)
+        self.assertEquals('200 OK', self.app.request('/batch', method='POST', data=data).status)
+
+
 if __name__ == "__main__":
     app = web.application(urls, globals())
     app.run()
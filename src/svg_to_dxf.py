@@ -1,8 +1,13 @@
 from __future__ import print_function, division
+import hashlib
 import math
-from contextlib import contextmanager
+import multiprocessing
+import re
 import sys
-import os
+import threading
+import unittest
+import StringIO
+from xml.dom import minidom, Node
 
 import pysvg.parser
 from pysvg.core import TextContent
@@ -12,18 +17,43 @@ import svg.path as path
 import ezdxf
 
 import transform as transform
+import bounds as bounds
+import entities as entities
+import r12 as r12
 import colortrans
 
 
-@contextmanager
-def stdout_ignore():
-    old_stdout = sys.stdout
-    sys.stdout = open(os.devnull, "w")
-    try:
-        yield
-    finally:
-        sys.stdout.close()
-        sys.stdout = old_stdout
+def _build(node, obj):
+    """
+    Same as pysvg.parser.build, minus its prints to stdout for unsupported attributes and elements.
+    """
+    if node.attributes is not None:
+        for name in node.attributes.keys():
+            setter = getattr(obj, pysvg.parser.calculateMethodName(name), None)
+            if setter is not None:
+                setter(node.attributes[name].value)
+
+    for child in node.childNodes:
+        if child.nodeType == Node.ELEMENT_NODE:
+            name = child.nodeName.split(':')[-1]
+            try:
+                child_obj = getattr(pysvg.parser, name[0].upper() + name[1:])()
+            except Exception:
+                continue
+            obj.addElement(_build(child, child_obj))
+        elif child.nodeType == Node.TEXT_NODE:
+            if child.nodeValue is not None:
+                obj.appendTextContent(child.nodeValue)
+        elif child.nodeType == Node.CDATA_SECTION_NODE:
+            obj.appendTextContent('<![CDATA[' + child.nodeValue + ']]>')
+        elif child.nodeType == Node.COMMENT_NODE:
+            obj.appendTextContent('<!-- ' + child.nodeValue + ' -->')
+    return obj
+
+
+def _parse_svg(svg_in):
+    doc = minidom.parse(svg_in)
+    return _build(doc.documentElement, structure.Svg())
 
 
 # noinspection PyUnusedLocal
@@ -134,22 +164,57 @@ def _point_on_arc(theta, c, r):
     return complex(math.cos(math.radians(theta)) * r.real + c.real, math.sin(math.radians(theta)) * r.imag + c.imag)
 
 
-def __append_path_to_dxf(element, msp, debug, context):
+def _segment_hull(segment, transform_):
+    """
+    Points, in transform_'s coordinates, whose convex hull contains segment.
+    These are the start, control and end points of lines and beziers.
+    """
+    if isinstance(segment, path.Line):
+        points = [segment.start, segment.end]
+    elif isinstance(segment, path.QuadraticBezier):
+        points = [segment.start, segment.control, segment.end]
+    elif isinstance(segment, path.CubicBezier):
+        points = [segment.start, segment.control1, segment.control2, segment.end]
+    elif isinstance(segment, path.Arc):
+        r = max(math.fabs(segment.radius.real), math.fabs(segment.radius.imag))
+        points = [segment.center + complex(x, y) for x in (-r, r) for y in (-r, r)]
+    else:
+        points = []
+    return [_complex_to_2tuple(c, transform_) for c in points]
+
+
+def _as_3tuple(point):
+    return point[0], point[1], 0
+
+
+def __append_path_to_dxf(segments, hulls, msp, debug, context):
+    """
+    hulls are the _segment_hull of each of segments in the context's transform, if already computed.
+    """
     if context.layer == 'ignore':
         return
 
-    parsed = path.parser.parse_path(element.get_d())
-    for segment in parsed:
+    box = context.cull.box if context.cull is not None else None
+    for index, segment in enumerate(segments):
+        hull = hulls[index] if hulls is not None else None
+        if box is not None and not isinstance(segment, path.Line):
+            if hull is None:
+                hull = _segment_hull(segment, context.transform)
+            if hull and not box.intersects(bounds.of_points(hull)):
+                continue
+
         if isinstance(segment, path.Line):
-            start = _complex_to_2tuple(segment.start, context.transform)
-            end = _complex_to_2tuple(segment.end, context.transform)
+            start, end = hull or _segment_hull(segment, context.transform)
+            if box is not None:
+                clipped = bounds.clip_line(box, start, end)
+                if clipped is None:
+                    continue
+                start, end = clipped
             line = msp.add_line(start=start, end=end)
             line.set_dxf_attrib('layer', context.layer)
 
         elif isinstance(segment, path.QuadraticBezier):
-            start = _complex_to_3tuple(segment.start, context.transform)
-            control = _complex_to_3tuple(segment.control, context.transform)
-            end = _complex_to_3tuple(segment.end, context.transform)
+            start, control, end = [_as_3tuple(p) for p in hull or _segment_hull(segment, context.transform)]
 
             spline = msp.add_spline()
             spline.set_control_points((start, control, control, end))
@@ -157,10 +222,7 @@ def __append_path_to_dxf(element, msp, debug, context):
             spline.set_dxf_attrib('layer', context.layer)
 
         elif isinstance(segment, path.CubicBezier):
-            start = _complex_to_3tuple(segment.start, context.transform)
-            control1 = _complex_to_3tuple(segment.control1, context.transform)
-            control2 = _complex_to_3tuple(segment.control2, context.transform)
-            end = _complex_to_3tuple(segment.end, context.transform)
+            start, control1, control2, end = [_as_3tuple(p) for p in hull or _segment_hull(segment, context.transform)]
 
             spline = msp.add_spline()
             spline.set_control_points((start, control1, control2, end))
@@ -193,42 +255,99 @@ def __append_path_to_dxf(element, msp, debug, context):
             debug(segment)
 
 
-def _append_element(element, msp, debug, context):
-    if isinstance(element, structure.G):
-        _append_subelements(element, msp, debug, context)
-
-    elif isinstance(element, shape.Path):
-        __append_path_to_dxf(element, msp, debug, context)
+def _element_to_path(element):
+    if isinstance(element, shape.Path):
+        return element
 
     elif isinstance(element, shape.Line):
-        aspath = _convert_line_to_path(element)
-        __append_path_to_dxf(aspath, msp, debug, context)
+        return _convert_line_to_path(element)
 
     elif isinstance(element, shape.Rect):
-        aspath = _convert_rect_to_path(element)
-        __append_path_to_dxf(aspath, msp, debug, context)
+        return _convert_rect_to_path(element)
 
     elif isinstance(element, shape.Polygon):
-        aspath = _convert_polygon_to_path(element)
-        __append_path_to_dxf(aspath, msp, debug, context)
+        return _convert_polygon_to_path(element)
 
     elif isinstance(element, shape.Polyline):
-        aspath = _convert_polyline_to_path(element)
-        __append_path_to_dxf(aspath, msp, debug, context)
+        return _convert_polyline_to_path(element)
 
     elif isinstance(element, shape.Circle):
-        aspath = _convert_circle_to_path(element)
-        __append_path_to_dxf(aspath, msp, debug, context)
+        return _convert_circle_to_path(element)
 
     elif isinstance(element, shape.Ellipse):
-        aspath = _convert_ellipse_to_path(element)
-        __append_path_to_dxf(aspath, msp, debug, context)
+        return _convert_ellipse_to_path(element)
+
+    return None
+
+
+def _shape_segments(element):
+    aspath = _element_to_path(element)
+    if aspath is None:
+        return None
+    return path.parser.parse_path(aspath.get_d())
+
+
+_CURVE_COMMANDS = re.compile(r'[CcSsQqTt]')
+
+
+def _has_curves(element):
+    """
+    Whether converting element writes splines.
+    """
+    if isinstance(element, (shape.Circle, shape.Ellipse)):
+        return True
+    if isinstance(element, shape.Path):
+        return _CURVE_COMMANDS.search(element.get_d() or '') is not None
+    if isinstance(element, structure.G):
+        return any(_has_curves(e) for e in element.getAllElements())
+    return False
+
+
+def _count_elements(element):
+    children = element.getAllElements() if hasattr(element, 'getAllElements') else []
+    return 1 + sum(_count_elements(e) for e in children)
+
+
+def _append_element(element, msp, debug, context):
+    if context.cull is not None:
+        visible_context = context.cull.visit(element, context)
+        if visible_context is None:
+            if context.progress is not None:
+                context.progress.advance(_count_elements(element))
+            return
+        context = visible_context
+
+    if context.progress is not None:
+        context.progress.advance()
+
+    element_id = None
+    if context.cache is not None and hasattr(element, 'getAttribute'):
+        element_id = element.getAttribute('id')
+
+    if element_id:
+        context.cache.append(element_id, element, msp, debug, context)
+    else:
+        _append_converted(element, msp, debug, context)
+
+
+def _append_converted(element, msp, debug, context):
+    if isinstance(element, structure.G):
+        _append_subelements(element, msp, debug, context)
 
     elif isinstance(element, TextContent):
         pass
 
     else:
-        debug(element)
+        segments, hulls = None, None
+        if context.cull is not None:
+            segments, hulls = context.cull.take_shape(element)
+        if segments is None:
+            segments = _shape_segments(element)
+
+        if segments is not None:
+            __append_path_to_dxf(segments, hulls, msp, debug, context)
+        else:
+            debug(element)
 
 
 def _append_subelements(element, msp, debug, context):
@@ -236,6 +355,319 @@ def _append_subelements(element, msp, debug, context):
         _append_element(e, msp, debug, context.element(e))
 
 
+def _presentation_attribute(element, name):
+    if not hasattr(element, 'getAttribute'):
+        return None
+
+    style = element.getAttribute('style')
+    if style:
+        for declaration in style.split(';'):
+            key, sep, value = declaration.partition(':')
+            if sep and key.strip() == name:
+                return value.strip()
+
+    return element.getAttribute(name)
+
+
+def _is_displayed(element):
+    if _presentation_attribute(element, 'display') == 'none':
+        return False
+
+    opacity = _presentation_attribute(element, 'opacity')
+    try:
+        return opacity is None or float(opacity) > 0
+    except ValueError:
+        return True
+
+
+class CullRegion(object):
+    """
+    Skips subtrees that are invisible or whose bounding box falls outside box (in dxf coordinates).
+    A box of None only culls invisible elements.
+    The segments parsed, and their hulls transformed, to compute the bounds of a shape are kept
+    until the shape is converted.
+    """
+
+    def __init__(self, box=None, shapes=None):
+        self.box = box
+        self._bounds = {}
+        self._shapes = shapes if shapes is not None else {}
+        self._inside = None
+
+    def __getstate__(self):
+        # cached bounds are keyed by element id, which does not survive pickling
+        return {'box': self.box, '_bounds': {}, '_shapes': {}, '_inside': None}
+
+    def take_shape(self, element):
+        """
+        The (segments, hulls) computed for element's bounds, (None, None) if they were not computed.
+        """
+        return self._shapes.pop(id(element), (None, None))
+
+    def element_bounds(self, element, context):
+        key = id(element)
+        if key not in self._bounds:
+            self._bounds[key] = self._compute_bounds(element, context)
+        return self._bounds[key]
+
+    def _compute_bounds(self, element, context):
+        if isinstance(element, structure.G):
+            result = None
+            for e in element.getAllElements():
+                result = bounds.union(result, self.element_bounds(e, context.element(e)))
+            return result
+
+        segments = _shape_segments(element)
+        if segments is None:
+            return None
+
+        hulls = [_segment_hull(segment, context.transform) for segment in segments]
+        self._shapes[id(element)] = (segments, hulls)
+        return bounds.of_points(p for hull in hulls for p in hull)
+
+    def visit(self, element, context):
+        if not _is_displayed(element):
+            return None
+
+        if not isinstance(element, structure.G) and not context.visible:
+            return None
+
+        if self.box is None:
+            return context
+
+        element_bounds = self.element_bounds(element, context)
+        if element_bounds is None or not self.box.intersects(element_bounds):
+            return None
+
+        if self.box.contains(element_bounds):
+            if self._inside is None:
+                self._inside = CullRegion(shapes=self._shapes)
+            return context.with_cull(self._inside)
+
+        return context
+
+
+class _CacheRecording(entities.EntityRecorder):
+    """
+    Records, in order, the entities and debug messages of converting an element, and the parts of the
+    elements within that have their own cache entry. The latter are kept by reference, not copied.
+    """
+
+    def __init__(self):
+        entities.EntityRecorder.__init__(self)
+        self.parts = []
+
+    def _end_entities(self):
+        if self.entities:
+            self.parts.append(('entities', self.entities))
+            self.entities = []
+
+    def debug(self, *objects):
+        self._end_entities()
+        self.parts.append(('debug', " ".join(str(o) for o in objects)))
+
+    def include(self, parts):
+        self._end_entities()
+        self.parts.append(('parts', parts))
+
+    def finish(self):
+        self._end_entities()
+        return self.parts
+
+
+def _replay_parts(parts, msp, debug):
+    for kind, value in parts:
+        if kind == 'entities':
+            entities.replay(value, msp)
+        elif kind == 'debug':
+            debug(value)
+        else:
+            _replay_parts(value, msp, debug)
+
+
+class ConversionCache(object):
+    """
+    Keeps the entities and debug messages converted for each element with an id between conversions of
+    a document that changes a little at a time. Entries are keyed by the element's id, subtree and context,
+    so elements sharing an id get an entry each, and one is reused while all three are unchanged. Entries share the recordings of the entries within them, so nested ids don't multiply
+    the entities kept.
+    Only entries looked up by the latest conversion are kept, hits and misses count its lookups.
+    A cache is used by one conversion at a time.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._fingerprints = {}
+        self._seen = []
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def begin(self):
+        self._fingerprints = {}
+        self._seen = []
+        self.hits = 0
+        self.misses = 0
+
+    def end(self, completed):
+        if completed:
+            for key in set(self._entries) - set(self._seen):
+                del self._entries[key]
+        self._fingerprints = {}
+
+    def fingerprint(self, element):
+        key = id(element)
+        if key not in self._fingerprints:
+            if isinstance(element, TextContent):
+                content = element.content
+            else:
+                content = (sorted(element.getAttributes().items()),
+                           [self.fingerprint(e) for e in element.getAllElements()])
+            self._fingerprints[key] = hashlib.sha1(repr((element.__class__.__name__, content))).hexdigest()
+        return self._fingerprints[key]
+
+    def append(self, element_id, element, msp, debug, context):
+        key = (element_id, self.fingerprint(element), context.key())
+        self._seen.append(key)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            # keeps the entries of the elements within, which are not looked up this time
+            self._seen.extend(entry[1])
+            if context.progress is not None:
+                context.progress.advance(_count_elements(element) - 1)
+            parts = entry[0]
+        else:
+            self.misses += 1
+            start = len(self._seen)
+            recording = _CacheRecording()
+            _append_converted(element, recording, recording.debug, context)
+            parts = recording.finish()
+            self._entries[key] = (parts, self._seen[start:])
+
+        if isinstance(msp, _CacheRecording):
+            msp.include(parts)
+        else:
+            _replay_parts(parts, msp, debug)
+
+
+def _partition(element, context, min_units):
+    """
+    Splits the children of element into (element, context) work units, in document order.
+    Groups are expanded into their children until there are at least min_units units.
+    Expanded groups are reported to the context's progress, the units are stripped of it.
+    """
+    progress = context.progress
+    context = context.with_progress(None)
+    units = [(e, context.element(e)) for e in element.getAllElements()]
+    while len(units) < min_units and any(isinstance(e, structure.G) for e, _ in units):
+        expanded = []
+        for e, c in units:
+            if isinstance(e, structure.G):
+                if c.cull is not None:
+                    c = c.cull.visit(e, c)
+                    if c is None:
+                        if progress is not None:
+                            progress.advance(_count_elements(e))
+                        continue
+                if progress is not None:
+                    progress.advance()
+                expanded.extend((child, c.element(child)) for child in e.getAllElements())
+            else:
+                expanded.append((e, c))
+        units = expanded
+
+    return units
+
+
+# the (drawing, modelspace) units are converted into within a pool process, set up by _init_worker
+_worker = None
+
+
+def _init_worker(dxf_version, tolerance, precision):
+    global _worker
+    dwg = _new_drawing(dxf_version, tolerance, precision)
+    _worker = dwg, _modelspace(dwg, precision)
+
+
+_ENTITIES_SECTION = re.compile(r'^ *2\nENTITIES\n', re.M)
+_ENTITY_HANDLE = re.compile(r'^  5\n[0-9A-F]+\n', re.M)
+
+
+def _entities_text(dwg):
+    """
+    The entities of dwg as written within its ENTITIES section.
+    """
+    out = StringIO.StringIO()
+    dwg.entities.write(out)
+    section = out.getvalue()
+    start = _ENTITIES_SECTION.search(section).end()
+    end = section.rindex('\n', 0, section.rindex('ENDSEC') - 1) + 1
+    return section[start:end]
+
+
+def _convert_unit(unit):
+    element, context, debug_enabled = unit
+    dwg, msp = _worker
+    messages = []
+    debug = (lambda *objects: messages.append(" ".join(str(o) for o in objects))) if debug_enabled else _noop
+    try:
+        _append_element(element, msp, debug, context)
+        return _entities_text(dwg), messages
+    finally:
+        dwg.modelspace().delete_all_entities()
+
+
+def _convert_subelements_parallel(element, debug, context, options, dxf_version):
+    """
+    Converts the subelements of element in a pool of options.processes processes, which write the entities
+    of their units as dxf_version dxf. Returns the written entities in document order.
+    """
+    units = _partition(element, context, options.processes * 4)
+    debug_enabled = debug is not _noop
+    chunksize = max(1, len(units) // (options.processes * 4))
+
+    pool = multiprocessing.Pool(options.processes, _init_worker,
+                                (dxf_version, options.tolerance, options.precision))
+    entities_text = []
+    try:
+        results = pool.imap(_convert_unit, [(e, c, debug_enabled) for e, c in units], chunksize)
+        for (e, _), (text, messages) in zip(units, results):
+            for message in messages:
+                debug(message)
+            entities_text.append(text)
+            if context.progress is not None:
+                context.progress.advance(_count_elements(e))
+    finally:
+        pool.terminate()
+        pool.join()
+    return entities_text
+
+
+def _write_with_entities(dwg, entities_text, dxf_out):
+    """
+    Writes dwg, whose modelspace is empty, with entities_text spliced into its ENTITIES section.
+    The entities are given handles from dwg, as if they had been added to its modelspace.
+    """
+    if hasattr(dwg, 'entitydb'):
+        handles = dwg.entitydb.handles
+        entities_text = [_ENTITY_HANDLE.sub(lambda match: '  5\n%s\n' % handles.next(), text)
+                         for text in entities_text]
+
+    out = StringIO.StringIO()
+    dwg.write(out)
+    written = out.getvalue()
+    split = _ENTITIES_SECTION.search(written).end()
+    dxf_out.write(written[:split])
+    for text in entities_text:
+        dxf_out.write(text)
+    dxf_out.write(written[split:])
+
+
 __units = {
     "unitless": 0,
     "in": 1,
@@ -246,10 +678,42 @@ __units = {
 }
 
 
+class Progress(object):
+    def __init__(self, callback, total):
+        self.callback = callback
+        self.total = total
+        self.done = 0
+
+    def advance(self, count=1):
+        self.done += count
+        self.callback(self.done, self.total)
+
+
 class ElementContext(object):
-    def __init__(self, transform_=transform.IDENTITY, layer='default'):
+    def __init__(self, transform_=transform.IDENTITY, layer='default', cull=None, visible=True, progress=None,
+                 cache=None):
         self.transform = transform_
         self.layer = layer
+        self.cull = cull
+        self.visible = visible
+        self.progress = progress
+        self.cache = cache
+
+    def with_cull(self, cull):
+        return ElementContext(self.transform, self.layer, cull, self.visible, self.progress, self.cache)
+
+    def with_progress(self, progress):
+        return ElementContext(self.transform, self.layer, self.cull, self.visible, progress, self.cache)
+
+    def with_cache(self, cache):
+        return ElementContext(self.transform, self.layer, self.cull, self.visible, self.progress, cache)
+
+    def key(self):
+        """
+        What the entities converted in this context depend on.
+        """
+        cull_box = self.cull.box.as_tuple() if self.cull is not None and self.cull.box is not None else None
+        return self.transform.m, self.layer, self.visible, self.cull is not None, cull_box
 
     # noinspection PyProtectedMember
     def element(self, element):
@@ -265,12 +729,16 @@ class ElementContext(object):
                     layer = class_[len('dxf-layer-'):].strip()
                     break
 
-        return ElementContext(transform_, layer)
+        visible = self.visible
+        visibility = _presentation_attribute(element, 'visibility')
+        if visibility:
+            visible = visibility not in ('hidden', 'collapse')
+
+        return ElementContext(transform_, layer, self.cull, visible, self.progress, self.cache)
 
 
 def create_layers(dwg, layer_to_style):
-    if layer_to_style is None:
-        layer_to_style = {}
+    layer_to_style = dict(layer_to_style or {})
 
     if 'default' not in layer_to_style:
         layer_to_style['default'] = {'color': '#000000'}
@@ -281,20 +749,314 @@ def create_layers(dwg, layer_to_style):
             layer.set_color(colortrans.rgb2short(styles['color']))
 
 
-def convert(svg_in, dxf_out, layer_to_style=None, debug_out=None):
+def _document_region(svg):
+    view_box = svg.getAttribute('viewBox')
+    if view_box:
+        return view_box
+
+    try:
+        width = float(svg.getAttribute('width').strip().rstrip('px'))
+        height = float(svg.getAttribute('height').strip().rstrip('px'))
+    except (AttributeError, ValueError):
+        return None
+    return 0, 0, width, height
+
+
+class ConvertOptions(object):
+    """
+    Per call conversion options.
+    With cull (implied by cull_region) invisible subtrees and geometry outside cull_region are skipped.
+    cull_region uses the svg viewBox format (min-x, min-y, width, height), either as a tuple or a string,
+    and defaults to the document viewBox.
+    With processes > 1 the top level groups are converted, and their entities written, in a process pool
+    of that size; the output is the same as converting serially.
+    progress is called with (elements processed, total elements) as the conversion advances,
+    an exception raised from it aborts the conversion.
+    With a ConversionCache, unchanged elements with an id reuse the entities of the previous conversion
+    using that cache; such conversions run serially.
+    precision rounds coordinates to that many decimals. dxf_version is 'AC1015' (R2000, written by ezdxf)
+    or 'AC1009', a minimal R12 with splines flattened to polylines deviating at most tolerance from them,
+    before rounding, as far as r12.MAX_SEGMENTS segments per spline allow. R12 suits small, mostly straight parts; curves take more space flattened than as splines.
+    compact makes precision default to 3 and dxf_version default to R12 for drawings without splines,
+    which holds their lines and polylines in a fraction of the space, and to R2000 otherwise.
+    Raises ValueError for an invalid cull_region or dxf_version, or a tolerance below r12.MIN_TOLERANCE.
+    """
+
+    def __init__(self, cull=False, cull_region=None, processes=None, progress=None, cache=None,
+                 compact=False, precision=None, dxf_version=None, tolerance=0.1):
+        self.cull = cull or cull_region is not None
+        self.cull_region = cull_region
+        self.processes = processes
+        self.progress = progress
+        self.cache = cache
+        self.precision = precision if precision is not None or not compact else 3
+        # None lets the conversion choose
+        self.dxf_version = dxf_version if dxf_version is not None or compact else 'AC1015'
+        self.tolerance = tolerance
+
+        if cull_region is not None:
+            bounds.from_view_box(cull_region)
+        if dxf_version is not None and dxf_version not in ('AC1015', r12.VERSION):
+            raise ValueError("dxf_version must be 'AC1015' or '%s'" % r12.VERSION)
+        if not r12.MIN_TOLERANCE <= tolerance < float('inf'):
+            raise ValueError("tolerance must be a finite number of at least %g" % r12.MIN_TOLERANCE)
+
+
+def _new_drawing(dxf_version, tolerance, precision):
+    if dxf_version == r12.VERSION:
+        return r12.Drawing(tolerance=tolerance, precision=precision)
+    return ezdxf.new(dxf_version)
+
+
+def _modelspace(dwg, precision):
+    msp = dwg.modelspace()
+    if precision is not None:
+        msp = entities.rounding_modelspace(msp, precision)
+    return msp
+
+
+def convert(svg_in, dxf_out, layer_to_style=None, debug_out=None, options=None, **kwargs):
+    """
+    Converts without touching global state or its arguments, so it is safe to call from several threads.
+    Options are given either as a ConvertOptions or as its keyword arguments, not both.
+    """
+    if options is None:
+        options = ConvertOptions(**kwargs)
+    elif kwargs:
+        raise TypeError("options given both as a ConvertOptions and as keyword arguments: " +
+                        ", ".join(sorted(kwargs)))
+
     if debug_out is not None:
         debug = lambda *objects: print(*objects, file=debug_out)
     else:
         debug = _noop
 
-    with stdout_ignore():
-        svg = pysvg.parser.parse(svg_in)
-    dwg = ezdxf.new('AC1015')
+    svg = _parse_svg(svg_in)
+    dxf_version = options.dxf_version
+    if dxf_version is None:
+        dxf_version = 'AC1015' if any(_has_curves(e) for e in svg.getAllElements()) else r12.VERSION
+    dwg = _new_drawing(dxf_version, options.tolerance, options.precision)
     create_layers(dwg, layer_to_style)
 
-    msp = dwg.modelspace()
+    msp = _modelspace(dwg, options.precision)
     transform_ = transform.matrix(1, 0, 0, -1, 0, 0)
     context = ElementContext(transform_=transform_).element(svg)
-    _append_subelements(svg, msp, debug, context)
+    if options.cull:
+        region = options.cull_region if options.cull_region is not None else _document_region(svg)
+        box = bounds.from_view_box(region).transformed(context.transform) if region is not None else None
+        context = context.with_cull(CullRegion(box))
+    if options.progress is not None:
+        total = sum(_count_elements(e) for e in svg.getAllElements())
+        context = context.with_progress(Progress(options.progress, total))
+
+    if options.cache is not None:
+        options.cache.begin()
+        completed = False
+        try:
+            _append_subelements(svg, msp, debug, context.with_cache(options.cache))
+            completed = True
+        finally:
+            options.cache.end(completed)
+    elif options.processes is not None and options.processes > 1:
+        entities_text = _convert_subelements_parallel(svg, debug, context, options, dxf_version)
+        _write_with_entities(dwg, entities_text, dxf_out)
+        return
+    else:
+        _append_subelements(svg, msp, debug, context)
 
     dwg.write(dxf_out)
+
+
+_TEST_SVG = """<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 200 200" unsupported-attribute="x">
+    <g transform="translate(10,20)" class="dxf-layer-cut">
+        <path d="M0,0 L50,30 H80 V0 Z"/>
+        <rect x="5" y="5" width="20" height="10"/>
+    </g>
+    <circle cx="100" cy="100" r="40"/>
+    <path d="M10,150 Q50,100 90,150 T170,150 A20,20 0 0,1 190,170"/>
+    <unsupported-element/>
+</svg>
+"""
+
+
+_TEST_LAYER_TO_STYLE = {'cut': {'color': '#ff0000'}}
+
+
+def _entities_section(dxf):
+    start = dxf.index("ENTITIES")
+    return dxf[start:dxf.index("ENDSEC", start)]
+
+
+def _test_entities(**options):
+    """
+    Entities of _TEST_SVG converted here with _TEST_LAYER_TO_STYLE, which other ways of converting it must match.
+    """
+    dxf_out = StringIO.StringIO()
+    convert(StringIO.StringIO(_TEST_SVG), dxf_out, layer_to_style=_TEST_LAYER_TO_STYLE, **options)
+    return _entities_section(dxf_out.getvalue())
+
+
+class ConvertThreadSafetyTest(unittest.TestCase):
+    def _convert(self, layer_to_style):
+        dxf_out = StringIO.StringIO()
+        convert(StringIO.StringIO(_TEST_SVG), dxf_out, layer_to_style=layer_to_style)
+        return _entities_section(dxf_out.getvalue())
+
+    def testConcurrentConvert(self):
+        layer_to_style = {'cut': {'color': '#ff0000'}}
+        expected = self._convert(layer_to_style)
+        stdout = sys.stdout
+        results = []
+
+        def run():
+            for _ in range(10):
+                results.append(self._convert(layer_to_style))
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEquals(80, len(results))
+        for result in results:
+            self.assertEquals(expected, result)
+        self.assertIs(stdout, sys.stdout)
+        self.assertEquals({'cut': {'color': '#ff0000'}}, layer_to_style)
+
+    def testOptionsAndKeywordArguments(self):
+        self.assertRaises(TypeError, convert, StringIO.StringIO(_TEST_SVG), StringIO.StringIO(),
+                          options=ConvertOptions(), precision=2)
+
+
+class ConvertParallelTest(unittest.TestCase):
+    def testSameAsSerial(self):
+        for options in ({}, {'cull': True}, {'dxf_version': r12.VERSION}):
+            self.assertEquals(_test_entities(**options), _test_entities(processes=2, **options))
+
+
+class CullTest(unittest.TestCase):
+    def _lines(self, body, **options):
+        svg = '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 100 100">%s</svg>' % body
+        dxf_out = StringIO.StringIO()
+        convert(StringIO.StringIO(svg), dxf_out, dxf_version=r12.VERSION, **options)
+        tags = _entities_section(dxf_out.getvalue()).split("\n")[1:-2]
+        lines = []
+        for code, value in zip(tags[0::2], tags[1::2]):
+            if code == '0':
+                lines.append(())
+            elif code in ('10', '20', '11', '21'):
+                lines[-1] += (float(value),)
+        return lines
+
+    def testDisplayNone(self):
+        body = '<path style="fill:red; display : none" d="M0,0 L10,10"/><path d="M0,0 L10,0"/>'
+        self.assertEquals([(0, 0, 10, 0)], self._lines(body, cull=True))
+        self.assertEquals(2, len(self._lines(body)))
+
+    def testOpacityZero(self):
+        body = '<g opacity="0"><path d="M0,0 L10,10"/></g><path opacity="0.5" d="M0,0 L10,0"/>'
+        self.assertEquals([(0, 0, 10, 0)], self._lines(body, cull=True))
+
+    def testVisibleChildOfHiddenParent(self):
+        body = '<g visibility="hidden"><path d="M0,0 L10,0"/><path visibility="visible" d="M0,5 L10,5"/></g>'
+        self.assertEquals([(0, -5, 10, -5)], self._lines(body, cull=True))
+
+    def testDefaultRegionIsViewBox(self):
+        body = '<path d="M200,200 L300,300"/><g transform="translate(-500,0)"><path d="M0,0 L10,0"/></g>' \
+               '<path d="M10,10 L20,20"/>'
+        self.assertEquals([(10, -10, 20, -20)], self._lines(body, cull=True))
+        self.assertEquals([(200, -200, 300, -300)], self._lines(body, cull_region='150 150 200 200'))
+
+    def testClipLine(self):
+        body = '<path d="M-50,10 L50,10 L150,10"/>'
+        self.assertEquals([(0, -10, 50, -10), (50, -10, 100, -10)], self._lines(body, cull=True))
+
+
+class CompactTest(unittest.TestCase):
+    def testPrecision(self):
+        for dxf_version in ('AC1015', r12.VERSION):
+            dxf_out = StringIO.StringIO()
+            convert(StringIO.StringIO(_TEST_SVG), dxf_out, compact=True, dxf_version=dxf_version)
+            tags = [tag.strip() for tag in _entities_section(dxf_out.getvalue()).split("\n")]
+            coordinates = [value for code, value in zip(tags[1::2], tags[2::2]) if code in ('10', '20', '11', '21')]
+            self.assertGreater(len(coordinates), 20)
+            for value in coordinates:
+                self.assertLessEqual(len(value.partition('.')[2]), 3, (dxf_version, value))
+
+    def testInvalidVersion(self):
+        self.assertRaises(ValueError, ConvertOptions, dxf_version='AC1018')
+
+    def testVersion(self):
+        straight = '<svg xmlns="http://www.w3.org/2000/svg"><g><path d="M0,0 L1,1 A1,1 0 0,1 2,2"/>' \
+                   '<rect width="1" height="1"/></g></svg>'
+        curved = straight.replace('</g>', '<path d="m0,0 q1,1 2,0"/></g>')
+        for svg, options, version in ((straight, {}, 'AC1015'), (straight, {'compact': True}, r12.VERSION),
+                                      (straight, {'compact': True, 'processes': 2}, r12.VERSION),
+                                      (straight, {'compact': True, 'dxf_version': 'AC1015'}, 'AC1015'),
+                                      (curved, {'compact': True}, 'AC1015'),
+                                      (_TEST_SVG, {'compact': True}, 'AC1015')):
+            dxf_out = StringIO.StringIO()
+            convert(StringIO.StringIO(svg), dxf_out, **options)
+            self.assertEquals(version == 'AC1015', 'AC1015' in dxf_out.getvalue(), (svg, options))
+
+
+class ConversionCacheTest(unittest.TestCase):
+    def _convert(self, svg, cache):
+        dxf_out = StringIO.StringIO()
+        convert(StringIO.StringIO(svg), dxf_out, cache=cache)
+        return _entities_section(dxf_out.getvalue())
+
+    def testReconvertEdited(self):
+        svg = _TEST_SVG.replace('<g ', '<g id="g1" ').replace('<circle ', '<circle id="c1" ')
+        edited = svg.replace('r="40"', 'r="41"')
+        cache = ConversionCache()
+
+        self.assertEquals(self._convert(svg, None), self._convert(svg, cache))
+        self.assertEquals((0, 2), (cache.hits, cache.misses))
+        self.assertEquals(self._convert(edited, None), self._convert(edited, cache))
+        self.assertEquals((1, 1), (cache.hits, cache.misses))
+        self.assertEquals(self._convert(edited, None), self._convert(edited, cache))
+        self.assertEquals(1.0, cache.hit_rate())
+
+    def testNestedEntriesShareRecordings(self):
+        svg = '<svg xmlns="http://www.w3.org/2000/svg"><g id="outer"><path d="M0,0 L1,1"/>' \
+              '<g id="inner"><path d="M1,1 L2,2"/></g></g></svg>'
+        cache = ConversionCache()
+        self.assertEquals(self._convert(svg, None), self._convert(svg, cache))
+        parts = dict((key[0], entry[0]) for key, entry in cache._entries.items())
+        inner, outer = parts['inner'], parts['outer']
+        self.assertEquals(['entities', 'parts'], [kind for kind, _ in outer])
+        self.assertIs(inner, outer[1][1])
+
+    def testDuplicateIds(self):
+        svg = '<svg xmlns="http://www.w3.org/2000/svg"><path id="p" d="M0,0 L1,1"/><path id="p" d="M1,1 L2,2"/>' \
+              '<g id="g" transform="scale(2)"><path d="M0,0 L1,1"/></g><g id="g"><path d="M0,0 L1,1"/></g></svg>'
+        cache = ConversionCache()
+        self.assertEquals(self._convert(svg, None), self._convert(svg, cache))
+        self.assertEquals((0, 4), (cache.hits, cache.misses))
+        self.assertEquals(self._convert(svg, None), self._convert(svg, cache))
+        self.assertEquals((4, 0), (cache.hits, cache.misses))
+
+    def testDebugMessagesOfHits(self):
+        svg = '<svg xmlns="http://www.w3.org/2000/svg"><g id="g"><text>a</text><path d="M0,0 L1,1"/></g></svg>'
+        cache = ConversionCache()
+        messages = []
+        for _ in range(2):
+            debug_out = StringIO.StringIO()
+            convert(StringIO.StringIO(svg), StringIO.StringIO(), debug_out=debug_out, cache=cache)
+            messages.append(debug_out.getvalue())
+        self.assertEquals((1, 0), (cache.hits, cache.misses))
+        self.assertIn("pysvg.text.Text", messages[0])
+        self.assertEquals(messages[0], messages[1])
+
+    def testContextChange(self):
+        svg = '<svg xmlns="http://www.w3.org/2000/svg"><g transform="scale(%d)"><path id="p" d="M0,0 L1,1"/></g></svg>'
+        cache = ConversionCache()
+        self._convert(svg % 1, cache)
+        self.assertEquals(self._convert(svg % 2, None), self._convert(svg % 2, cache))
+        self.assertEquals((0, 1), (cache.hits, cache.misses))
+
+
+if __name__ == "__main__":
+    unittest.main()